@@ -3,110 +3,242 @@ import sys
 import re
 import json
 import shutil
+import tempfile
+import multiprocessing
+from array import array
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 
-from nltk.tokenize import word_tokenize, sent_tokenize
-from nltk.corpus import wordnet
+from nltk.corpus.reader.wordnet import NOUN, VERB     # plain pos tags, does not load WordNet
 from nltk.stem import WordNetLemmatizer
 
+try:
+    import orjson               # optional, faster index.json encode and decode
+except ImportError:
+    orjson = None
+
+# tokens follow the NLTK Treebank tokenizer: do|n't, we|'re, can|not, gon|na, 7.25, well-known, café,
+# a '.' stays on its word (pct., Corp.) unless it ends the sentence
+CONTRACTION = r"n't|'(?:re|ve|ll|m|d|s)"           # contraction suffix split off its word
+SPLIT_WORD = r"can(?=not\b)|d(?='ye\b)|gim(?=me\b)|gon(?=na\b)|got(?=ta\b)|lem(?=me\b)|more(?='n\b)|wan(?=na(?!\S))"     # first part of a word split in two
+WORD_CHAR = r"(?:(?!(?i:n't)\b)[^\W_])"            # unicode letter or digit, stops before n't
+END_DOT = r"(?:\.(?!\.)(?!(?:[\])}>'»”’\s]|(?<![\s(\[{<])\")*$))?"    # trailing '.', unless it is the final period
+TOKEN_RE = re.compile(
+    r"(?i:\b(?:" + SPLIT_WORD + r"))"              # first part of cannot, gonna, ...
+    r"|[^\W\d_]+(?:\.[^\W\d_]+)+" + END_DOT +       # abbreviation
+    r"|(?i:" + CONTRACTION + r")\b"                 # contraction suffix
+    r"|\d+(?:[.,]\d+)*(?![\w-])" + END_DOT +        # number, may hold '.' or ','
+    r"|--"                                          # dash
+    r"|-?" + WORD_CHAR + r"+(?:(?:-|(?!(?i:" + CONTRACTION + r")\b)')" + WORD_CHAR + r"+)*(?:-(?!-))?" + END_DOT +   # word with inner '-' or "'"
+    r"|[^\s\w]"                                     # single symbol
+)
+SENTENCE_RE = re.compile(r"(?<=[.!?])\s+(?![\sa-z])")     # split after end punctuation, not before a lowercase word
+POSSESSIVE_RE = re.compile(r"'s|s'")               # possessive suffix
+THOUSAND_RE = re.compile(r"(\d{1,3})(,\d{3})+")     # number with thousands commas
+ABBREV_RE = re.compile(r"[a-z]\.[a-z]\.")           # abbreviation such as u.s.
+
+
+# remove the comma in a thousands number match
+def strip_commas(m: re.Match) -> str:
+    return m.group().replace(",", "")
+
+
+# link a document into the index folder, copy only when no link can be made
+# the new entry is made in staging_folder first, then swapped in
+def link_doc(ori_path: str, target_path: str, staging_folder: str) -> None:
+    if os.path.exists(target_path) and os.path.samefile(ori_path, target_path):
+        return                                  # already the source, e.g. indexing the index's own doc folder
+    temp_path = os.path.join(staging_folder, "doc")
+    try:
+        os.symlink(os.path.abspath(ori_path), temp_path)
+    except OSError:                             # no symlink permission, e.g. Windows
+        try:
+            os.link(ori_path, temp_path)
+        except OSError:                         # hard link across filesystems
+            shutil.copyfile(ori_path, temp_path)
+    os.replace(temp_path, target_path)          # replaces an entry of an earlier build, never the file it points to
+
+
+# order files by number when named by number, so doc id order is the output tie-break order
+def doc_order(name: str):
+    return (0, int(name), name) if name.isdecimal() else (1, 0, name)
+
+
+_worker = None          # FileProcess of the current worker process, keeps its caches across files
+
+# set up a worker process of the index pool
+def init_worker() -> None:
+    global _worker
+    _worker = FileProcess()
+
+# index one file in a worker process, term to positions and line ids, and line offsets
+def process_file(file_path: str) -> tuple[dict[str, tuple[array, array]], array]:
+    return _worker.file_index(file_path)
+
+
 # read file and build inverted index
 class FileProcess:
 
     def __init__(self) -> None:
         self.lemmatizer = WordNetLemmatizer()
-        self.inverted_index: dict[str, list[list]] = defaultdict(list)    # inverted index
-        self.unique_words: set[str] = set()        # all unique words appeared
+        self.inverted_index: dict[str, list[tuple[int, array, array]]] = defaultdict(list)    # term to (doc id, positions, line ids) per doc
+        self.docs: list[str] = []       # file name of each doc id
         self.num_file = 0              # count the number of files
 
+        # cache per instance so the key is the word only, not self
+        self.find_root = lru_cache(maxsize=200_000)(self.find_root)
+        self.normalize_token = lru_cache(maxsize=200_000)(self.normalize_token)
+
+    # all unique words appeared
+    @property
+    def unique_words(self):
+        return self.inverted_index.keys()
+
     # generate all root for a word
-    def find_root(self, word: str) -> set[str]:
-        root = {
-            self.lemmatizer.lemmatize(word),                        # default lemmatization
-            self.lemmatizer.lemmatize(word, pos=wordnet.NOUN),      # lemmatization as noun
-            self.lemmatizer.lemmatize(word, pos=wordnet.VERB),      # lemmatization as verb
-        }
+    def find_root(self, word: str) -> frozenset[str]:
+        lemmatize = self.lemmatizer.lemmatize       # local lookup on cache miss
+        root = frozenset((
+            lemmatize(word),                # default lemmatization
+            lemmatize(word, pos=NOUN),      # lemmatization as noun
+            lemmatize(word, pos=VERB),      # lemmatization as verb
+        ))
         return root
 
-    # normalize tokens into a set to use in index
-    def normalize_token(self, token: str) -> list[str]:
+    # normalize tokens into a set to use in index (cached, do not mutate result)
+    def normalize_token(self, token: str) -> tuple[str, ...]:
         token = token.lower()           # lower case
         token = token.replace("'s", "").replace("s'", "")   # remove possessives
 
         # process abbreviation
-        if re.fullmatch(r"[a-z]\.[a-z]\.", token):
-            return [token.replace(".", "")]
+        if ABBREV_RE.fullmatch(token):
+            return (token.replace(".", ""),)
 
         # keep numebers
         if token.isdigit():
-            return [token]
+            return (token,)
 
         # process '-'
         if "-" in token:
             splited_token = token.split("-")
             if len(splited_token[0]) < 3:          # short prefix keep original word
-                return list(self.find_root(token))
+                return tuple(self.find_root(token))
             
             # separate each part by '-'
             tokens = []
             for i in splited_token:
                 if i.isalnum():
                     tokens.extend(self.find_root(i))
-            return list(tokens)
+            return tuple(tokens)
 
         # normal English word
         if token.isalnum():
-            return list(self.find_root(token))
+            return tuple(self.find_root(token))
 
-        return []  # drop other symbols
+        return ()  # drop other symbols
 
     # preprocess the sentences
     def preprocess_sentence(self, sentence: str) -> str:
-        sentence = re.sub(r"'s|s'", "", sentence)           # remove possessives
-        sentence = re.sub(r"(\d{1,3})(,\d{3})+", lambda m: m.group().replace(",", ""), sentence)     # remove the comma in thousands number
+        if "'" not in sentence and "," not in sentence:
+            return sentence         # nothing to remove, skip both scans
+        sentence = POSSESSIVE_RE.sub("", sentence)                  # remove possessives
+        sentence = THOUSAND_RE.sub(strip_commas, sentence)          # remove the comma in thousands number
         return sentence
 
-    # tokenize the sentence and return result
-    def tokenize_sentence(self, sentence: str):
-        for i in word_tokenize(sentence):             # tokenize
-            for t in self.normalize_token(i):         # per word
-                yield t               # return normalized token 
-
-    # create inverted index for single file
-    def file_index(self, id: str, file_path: str) -> None:
+    # create inverted index for single file, term to positions and line ids,
+    # and the byte offset where each line starts
+    def file_index(self, file_path: str) -> tuple[dict[str, tuple[array, array]], array]:
+        index = defaultdict(lambda: (array("i"), array("i")))      # index of this file only
+        line_offsets = array("q")   # byte offset of each line
+        norm_map = {}               # raw token to normalized terms, each distinct token normalized once
         position = 0                # initial global token position
-        with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
-            for n, line in enumerate(f.read().splitlines()):      # read every line of file
-                for cur in sent_tokenize(line):                        # split to sentence
+        offset = 0                  # byte offset of current line
+        with open(file_path, "rb") as f:
+            for n, raw in enumerate(f):                           # read file line by line
+                line_offsets.append(offset)
+                offset += len(raw)
+                line = raw.decode("utf-8", errors="ignore").rstrip("\r\n")
+                for cur in SENTENCE_RE.split(line):                    # split to sentence
                     cur = self.preprocess_sentence(cur)               # preprocess sentence
-                    for t in self.tokenize_sentence(cur):              # tokenize sentence
-                        self.inverted_index[t].append([id, position, n])      # inverted index record
-                        self.unique_words.add(t)                        # add token into the unique word set
-                        position += 1                                   # update token position
+                    for token in TOKEN_RE.findall(cur):                # tokenize sentence in one call
+                        terms = norm_map.get(token)
+                        if terms is None:
+                            terms = norm_map[token] = self.normalize_token(token)
+                        for t in terms:
+                            positions, line_ids = index[t]
+                            positions.append(position)                  # inverted index record
+                            line_ids.append(n)
+                            position += 1                               # update token position
+        return dict(index), line_offsets        # plain dict so it can be sent back from a worker
+
+    # add the index of one file under a new doc id
+    def merge_index(self, name: str, index: dict[str, tuple[array, array]]) -> None:
+        id = len(self.docs)
+        self.docs.append(name)                  # intern file name to doc id
+        for t, (positions, line_ids) in index.items():
+            self.inverted_index[t].append((id, positions, line_ids))     # one segment per doc
 
     # save inverted inddex
     def save_index(self, index_folder: str) -> None:
-        with open(os.path.join(index_folder, "inverted_index.json"), "w") as f:
-            json.dump(self.inverted_index, f)
+        terms = {}                                  # term to offset and count of its segments
+        seg_docs, seg_starts = array("i"), array("i")       # doc id and postings start of each segment
+        positions, line_ids = array("i"), array("i")        # postings of all terms laid end to end
+        for t, segments in self.inverted_index.items():
+            terms[t] = [len(seg_docs), len(segments)]
+            for id, seg_positions, seg_line_ids in segments:
+                seg_docs.append(id)
+                seg_starts.append(len(positions))
+                positions.extend(seg_positions)
+                line_ids.extend(seg_line_ids)
+        seg_starts.append(len(positions))           # closing offset, segment j ends at seg_starts[j + 1]
+
+        with open(os.path.join(index_folder, "postings.bin"), "wb") as f:
+            positions.tofile(f)             # positions, then line ids
+            line_ids.tofile(f)
+        with open(os.path.join(index_folder, "segments.bin"), "wb") as f:
+            seg_docs.tofile(f)              # doc ids, then start offsets
+            seg_starts.tofile(f)
+        meta = {"docs": self.docs, "terms": terms}
+        with open(os.path.join(index_folder, "index.json"), "wb") as f:
+            f.write(orjson.dumps(meta) if orjson else json.dumps(meta).encode())
 
     # build index and process file
     def build_index(self, file_folder: str, index_folder: str) -> None:
         os.makedirs(index_folder, exist_ok=True)            # create index
         temp_file = os.path.join(index_folder, "doc")       # subfolder to save all files
         os.makedirs(temp_file, exist_ok=True)               # create subfolder
+        offsets_folder = os.path.join(index_folder, "offsets")     # line table of each file, apart from doc links
+        os.makedirs(offsets_folder, exist_ok=True)
+
+        names, paths = [], []
+        files = sorted(os.listdir(file_folder), key=doc_order)
+        staging_folder = tempfile.mkdtemp(dir=temp_file)    # links are made here, then moved into place
+        try:
+            for name in files:                                  # for every file in folder
+                ori_path = os.path.join(file_folder, name)      # original path of file
+                if not os.path.isfile(ori_path):                # ignore no file entries
+                    continue
+                target_folder = os.path.join(temp_file, name)       # target path in index
+                link_doc(ori_path, target_folder, staging_folder)   # link file into index
+                names.append(name)
+                paths.append(target_folder)
+        finally:
+            os.rmdir(staging_folder)
 
-        for name in sorted(os.listdir(file_folder)):        # for every file in folder
-            ori_path = os.path.join(file_folder, name)      # original path of file
-            if not os.path.isfile(ori_path):                # ignore no file entries
-                continue
-            target_folder = os.path.join(temp_file, name)       # target path after copy
-            shutil.copyfile(ori_path, target_folder)            # copy file to index
-            self.file_index(name, target_folder)                # create inverted index for file
-            self.num_file += 1                                  # update number of files  
+        # files are independent, index them in worker processes and merge in order
+        if multiprocessing.get_start_method() == "fork":
+            self.lemmatizer.lemmatize("words")      # load WordNet once, forked workers inherit it
+        with ProcessPoolExecutor(initializer=init_worker) as executor:     # default size, capped on Windows
+            for name, (index, line_offsets) in zip(names, executor.map(process_file, paths, chunksize=4)):
+                self.merge_index(name, index)           # create inverted index for file
+                with open(os.path.join(offsets_folder, name), "wb") as f:
+                    line_offsets.tofile(f)              # line table for print_match
+                self.num_file += 1                      # update number of files
 
         self.save_index(index_folder)               # save inverted index
 
         # calculate output
-        total_tokens = sum(len(v) for v in self.inverted_index.values())
+        total_tokens = sum(len(p) for v in self.inverted_index.values() for _, p, _ in v)
         total_terms = len(self.inverted_index)
         print(f"Total number of documents: {self.num_file}")
         print(f"Total number of tokens: {total_tokens}")
@@ -1,10 +1,118 @@
-import os, sys, re, json, itertools
+import os, sys, re, json, mmap
+from array import array
+from bisect import bisect_left, bisect_right
 from collections import defaultdict
+from functools import lru_cache
+from heapq import merge
+from itertools import repeat
 
-from nltk.tokenize import word_tokenize
-from nltk.corpus import wordnet
+from nltk.corpus.reader.wordnet import NOUN, VERB     # plain pos tags, does not load WordNet
 from nltk.stem import WordNetLemmatizer
 
+try:
+    import orjson               # optional, faster index.json encode and decode
+except ImportError:
+    orjson = None
+
+# tokens follow the NLTK Treebank tokenizer: do|n't, we|'re, can|not, gon|na, 7.25, well-known, café,
+# a '.' stays on its word (pct., Corp.) unless it ends the sentence
+CONTRACTION = r"n't|'(?:re|ve|ll|m|d|s)"           # contraction suffix split off its word
+SPLIT_WORD = r"can(?=not\b)|d(?='ye\b)|gim(?=me\b)|gon(?=na\b)|got(?=ta\b)|lem(?=me\b)|more(?='n\b)|wan(?=na(?!\S))"     # first part of a word split in two
+WORD_CHAR = r"(?:(?!(?i:n't)\b)[^\W_])"            # unicode letter or digit, stops before n't
+END_DOT = r"(?:\.(?!\.)(?!(?:[\])}>'»”’\s]|(?<![\s(\[{<])\")*$))?"    # trailing '.', unless it is the final period
+TOKEN_RE = re.compile(
+    r"(?i:\b(?:" + SPLIT_WORD + r"))"              # first part of cannot, gonna, ...
+    r"|[^\W\d_]+(?:\.[^\W\d_]+)+" + END_DOT +       # abbreviation
+    r"|(?i:" + CONTRACTION + r")\b"                 # contraction suffix
+    r"|\d+(?:[.,]\d+)*(?![\w-])" + END_DOT +        # number, may hold '.' or ','
+    r"|--"                                          # dash
+    r"|-?" + WORD_CHAR + r"+(?:(?:-|(?!(?i:" + CONTRACTION + r")\b)')" + WORD_CHAR + r"+)*(?:-(?!-))?" + END_DOT +   # word with inner '-' or "'"
+    r"|[^\s\w]"                                     # single symbol
+)
+SENTENCE_RE = re.compile(r"(?<=[.!?])\s+(?![\sa-z])")     # split after end punctuation, not before a lowercase word
+POSSESSIVE_RE = re.compile(r"'s|s'")               # possessive suffix
+THOUSAND_RE = re.compile(r"(\d{1,3})(,\d{3})+")     # number with thousands commas
+ABBREV_RE = re.compile(r"[a-z]\.[a-z]\.")           # abbreviation such as u.s.
+
+
+# remove the comma in a thousands number match
+def strip_commas(m: re.Match) -> str:
+    return m.group().replace(",", "")
+
+
+# find the combination with one position per term that has the shortest span,
+# then the most ordered pairs, then the smallest positions in query order
+# match_list[i] is the ascending position list of term i
+# ordered_pair[i] is True when term i and term i + 1 are adjacent in the query
+def best_window(match_list: list[list[int]], ordered_pair: list[bool]):
+    k = len(match_list)
+    # positions of each term are already ascending, merge them instead of sorting
+    events = list(merge(*(zip(plist, repeat(i)) for i, plist in enumerate(match_list))))
+
+    # sweep line, collect every window of minimal span that covers all terms
+    count = [0] * k             # occurrences of each term inside the window
+    covered = 0                 # number of terms inside the window
+    best_span = -1              # shortest span found, -1 means not found yet
+    windows = []                # (left, right) positions of shortest windows
+    left = 0
+    for right_pos, term in events:
+        if count[term] == 0:
+            covered += 1
+        count[term] += 1
+        while covered == k:             # shrink from left while all terms covered
+            left_pos, left_term = events[left]
+            span = right_pos - left_pos
+            if best_span < 0 or span < best_span:
+                best_span, windows = span, []
+            if span == best_span:
+                windows.append((left_pos, right_pos))
+            count[left_term] -= 1
+            if count[left_term] == 0:
+                covered -= 1
+            left += 1
+
+    # any choice inside a shortest window keeps the span, pick the most ordered one
+    max_pairs, best_position = -1, None
+    pairs_bound = sum(ordered_pair)         # no combination has more ordered pairs
+    for left_pos, right_pos in windows:
+        # windows come in ascending order, later ones only hold larger first positions
+        if max_pairs == pairs_bound and best_position[0] < left_pos:
+            break
+
+        cand = [plist[bisect_left(plist, left_pos):bisect_right(plist, right_pos)]
+                for plist in match_list]       # positions of each term inside window
+
+        # a pair can only be ordered if some position of term i is before one of term i + 1
+        window_bound = sum(ordered_pair[i] and cand[i][0] < cand[i + 1][-1] for i in range(k - 1))
+        if window_bound < max_pairs:
+            continue
+
+        # suffix[i][x]: max ordered pairs of terms i.. when term i takes cand[i][x]
+        suffix = [None] * k
+        suffix[k - 1] = [0] * len(cand[k - 1])
+        for i in range(k - 2, -1, -1):
+            nxt, nxt_score = cand[i + 1], suffix[i + 1]
+            suffix[i] = [max(s + (ordered_pair[i] and p < q) for q, s in zip(nxt, nxt_score))
+                         for p in cand[i]]
+
+        # walk forward taking the smallest position that keeps the optimum
+        pairs_num = max(suffix[0])
+        x = suffix[0].index(pairs_num)
+        position, target = [cand[0][x]], pairs_num
+        for i in range(k - 1):
+            p = position[-1]
+            for q, s in zip(cand[i + 1], suffix[i + 1]):
+                gain = ordered_pair[i] and p < q
+                if gain + s == target:
+                    position.append(q)
+                    target = s
+                    break
+
+        if pairs_num > max_pairs or (pairs_num == max_pairs and position < best_position):
+            max_pairs, best_position = pairs_num, position
+
+    return best_span - (k - 1), max_pairs, best_position       # sum of token interval
+
 
 class SearchEngine:
     ALPHA = 1.0
@@ -14,99 +122,121 @@ class SearchEngine:
     def __init__(self, index_folder: str):
         self.index_folder = index_folder                # inverted index
         self.lemmatizer = WordNetLemmatizer()
-        self.inverted_index: dict[str, list[list]] = {} # data structure of inverted data
+        self.docs: list[str] = []                       # file name of each doc id
+        self.terms: dict[str, list[int]] = {}           # term to offset and count of its segments
+        self.seg_docs = self.seg_starts = memoryview(b"").cast("i")     # doc id and postings start per segment
+        self.positions = self.line_ids = memoryview(b"").cast("i")      # postings columns
         self.load_index()                              # load index file
 
+        # cache per instance so the key is the word or query only, not self
+        self.find_root = lru_cache(maxsize=65536)(self.find_root)
+        self.normalize_token = lru_cache(maxsize=65536)(self.normalize_token)
+        self.preprocess_sentence = lru_cache(maxsize=4096)(self.preprocess_sentence)
+
     # load inverted index
     def load_index(self) -> None:
-        with open(os.path.join(self.index_folder, "inverted_index.json")) as f:
-            self.inverted_index = json.load(f)          # load from json file
+        with open(os.path.join(self.index_folder, "index.json"), "rb") as f:
+            data = f.read()
+        meta = orjson.loads(data) if orjson else json.loads(data)      # load from json file
+        self.docs, self.terms = meta["docs"], meta["terms"]
+
+        postings = self.map_ints("postings.bin")
+        n = len(postings) // 2          # positions, then line ids
+        self.positions, self.line_ids = postings[:n], postings[n:]
+
+        segments = self.map_ints("segments.bin")
+        n = len(segments) // 2          # doc ids, then start offsets plus one closing offset
+        self.seg_docs, self.seg_starts = segments[:n], segments[n:]
+
+    # memory map an int file of the index, pages are read lazily on first access
+    def map_ints(self, name: str) -> memoryview:
+        with open(os.path.join(self.index_folder, name), "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:       # empty corpus, nothing to map
+                return memoryview(b"").cast("i")
+            return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)).cast("i")
+
+    # positions of a term in each doc, one segment per doc
+    def doc_positions(self, term: str):
+        off, n = self.terms.get(term, (0, 0))
+        starts = self.seg_starts
+        for j in range(off, off + n):
+            yield self.seg_docs[j], self.positions[starts[j]:starts[j + 1]].tolist()
+
+    # postings range of a term in one doc, empty if the term is not in the doc
+    def doc_segment(self, term: str, id: int) -> range:
+        off, n = self.terms.get(term, (0, 0))
+        j = bisect_left(self.seg_docs, id, off, off + n)       # segments are in doc id order
+        if j == off + n or self.seg_docs[j] != id:
+            return range(0)
+        return range(self.seg_starts[j], self.seg_starts[j + 1])
 
     # generate all root for a word
-    def find_root(self, word: str) -> set[str]:
-        root = {
-            self.lemmatizer.lemmatize(word),                        # default lemmatization
-            self.lemmatizer.lemmatize(word, pos=wordnet.NOUN),      # lemmatization as noun
-            self.lemmatizer.lemmatize(word, pos=wordnet.VERB),      # lemmatization as verb
-        }
+    def find_root(self, word: str) -> frozenset[str]:
+        lemmatize = self.lemmatizer.lemmatize       # local lookup on cache miss
+        root = frozenset((
+            lemmatize(word),                # default lemmatization
+            lemmatize(word, pos=NOUN),      # lemmatization as noun
+            lemmatize(word, pos=VERB),      # lemmatization as verb
+        ))
         return root
 
-    # normalize token
-    def normalize_token(self, token: str) -> list[str]:
+    # normalize token (cached, do not mutate result)
+    def normalize_token(self, token: str) -> tuple[str, ...]:
         token = token.lower()           # lower case
         token = token.replace("'s", "").replace("s'", "")   # remove possessives
         
         # process abbreviation
-        if re.fullmatch(r"[a-z]\.[a-z]\.", token):
-            return [token.replace(".", "")]
+        if ABBREV_RE.fullmatch(token):
+            return (token.replace(".", ""),)
         
         # keep numebers
         if token.isdigit():
-            return [token]
+            return (token,)
         
         # process '-'
         if "-" in token:
             splited_token = token.split("-")
             if len(splited_token[0]) < 3:          # short prefix keep original word
-                return list(self.find_root(token))
+                return tuple(self.find_root(token))
             
             # separate each part by '-'
             tokens = []
             for i in splited_token:
                 if i.isalnum():
                     tokens.extend(self.find_root(i))
-            return tokens
+            return tuple(tokens)
         
         # normal English word
         if token.isalnum():
-            return list(self.find_root(token))
+            return tuple(self.find_root(token))
         
-        return []   # drop other symbols
+        return ()   # drop other symbols
 
-    # preprocess the sentence
-    def preprocess_sentence(self, sentence: str) -> list[str]:
-        sentence = re.sub(r"'s|s'", "", sentence)           # remove possessives
-        sentence = re.sub(r"(\d{1,3})(,\d{3})+", lambda m: m.group().replace(",", ""), sentence)     # remove the comma in thousands number
+    # preprocess the sentence (cached, do not mutate result)
+    def preprocess_sentence(self, sentence: str) -> tuple[str, ...]:
+        if "'" in sentence or "," in sentence:              # skip both scans when nothing to remove
+            sentence = POSSESSIVE_RE.sub("", sentence)                  # remove possessives
+            sentence = THOUSAND_RE.sub(strip_commas, sentence)          # remove the comma in thousands number
         
         terms = []
-        for i in word_tokenize(sentence):
-            terms.extend(self.normalize_token(i))       # expand multiple word forms
+        for cur in SENTENCE_RE.split(sentence):             # a query may hold several sentences
+            for m in TOKEN_RE.finditer(cur):
+                terms.extend(self.normalize_token(m.group()))       # expand multiple word forms
         
-        return list(dict.fromkeys(terms))           # remove duplicates, keep order
+        return tuple(dict.fromkeys(terms))          # remove duplicates, keep order
 
     # search the best matching combination for shortest distance
-    def shortest_distance(self, search_term: list[str], position: dict[str, list[int]]):
+    def shortest_distance(self, search_term: tuple[str, ...], position: dict[str, list[int]]):
         match_word  = [t for t in search_term if t in position]     # query terms actual hit
         match_list  = [position[t] for t in match_word]             # all matching positions for each term
 
         if not match_word:
             return float("inf"), 0, {}      # if all miss
 
-        best_distance  = float("inf")           # best total distance
-        max_number  = -1                        # max number of ordered word pairs
-        best_position = None                    # best position combination
-
-        # for all combination
-        for c in itertools.product(*match_list):
-            position_dic = dict(zip(match_word, c))
-
-            c = sorted(c)           # sort token position in ascending order
-            sum_int = sum(c[i + 1] - c[i] - 1
-                          for i in range(len(c) - 1))       # caculate sum of token interval 
-
-            # count ordered pairs based on original search_term sequence
-            pairs_num = 0
-            for i in range(len(search_term) - 1):
-                term1, term2 = search_term[i], search_term[i + 1]
-                if term1 in position_dic and term2 in position_dic:
-                    if position_dic[term1] < position_dic[term2]:
-                        pairs_num += 1
-
-            # update best, shorter or more order
-            if (sum_int < best_distance) or (
-                sum_int == best_distance and pairs_num > max_number
-            ):
-                best_distance, max_number, best_position = sum_int, pairs_num, position_dic
+        ordered_pair = [search_term.index(match_word[i + 1]) == search_term.index(match_word[i]) + 1
+                        for i in range(len(match_word) - 1)]       # adjacent in original query
+        best_distance, max_number, chosen = best_window(match_list, ordered_pair)
+        best_position = dict(zip(match_word, chosen))
 
         avg_distance = best_distance / max(len(match_word) - 1, 1)      # average token interval
         return avg_distance, max_number, best_position
@@ -121,24 +251,28 @@ class SearchEngine:
             return []           # query word is empty
 
 
-        match = defaultdict(lambda: defaultdict(list))       # file to the terms
+        match = defaultdict(dict)           # file to the terms and their positions
         for t in search_term:
-            if t in self.inverted_index:
-                for id, pos, line in self.inverted_index[t]:
-                    match[id][t].append((pos, line))
+            for id, positions in self.doc_positions(t):
+                match[id][t] = positions
 
-        temp_rank = []
+        ranked = []                 # one entry per file, match is keyed by file
         for id, pos in match.items():
             match_term = list(pos.keys())                      # match terms in current file
             coverage = len(match_term) / len(search_term)      # coverage
 
             if len(match_term) == 1:            # only one term matched
                 cur_score, pairs_num, chosen = 0, 0, {
-                    match_term[0]: pos[match_term[0]][0][0]     # get the first position
+                    match_term[0]: pos[match_term[0]][0]        # get the first position
                 }
+            elif all(len(v) == 1 for v in pos.values()):        # one position per term, one combination
+                chosen = {t: v[0] for t, v in pos.items()}
+                sum_int = max(chosen.values()) - min(chosen.values()) - (len(chosen) - 1)     # sum of token interval
+                pairs_num = sum(1 for t1, t2 in zip(search_term, search_term[1:])
+                                if t1 in chosen and t2 in chosen and chosen[t1] < chosen[t2])
+                cur_score = 1 / (1 + sum_int / (len(chosen) - 1))
             else:
-                position = {t: [p for p, _ in pos[t]] for t in match_term}      # all position of each term
-                avg_distance, pairs_num, chosen = self.shortest_distance(search_term, position)    # calculate min avg distance and ordered pairs
+                avg_distance, pairs_num, chosen = self.shortest_distance(search_term, pos)    # calculate min avg distance and ordered pairs
                 cur_score = 1 / (1 + avg_distance)          # shorter distance, higher score
             
             # calculate final score
@@ -146,53 +280,45 @@ class SearchEngine:
                      self.BETA  * cur_score +
                      self.GAMMA * pairs_num)
 
-            temp_rank.append((id, score, chosen))       # save file id, score, best match position
-
-        # remove duplicate keep the highest score
-        unique = {}
-        for id, score, chosen in temp_rank:
-            if (id not in unique) or (score > unique[id][0]):
-                unique[id] = (score, chosen)            # update tot the higher score combination
+            ranked.append((id, score, chosen))       # save file id, score, best match position
 
-        ranked = [(d, *info) for d, info in unique.items()]     # change stucture to list
         # Fix tie-breaking with floating point precision tolerance
-        ranked.sort(key=lambda x: (-round(x[1], 10), int(x[0])))           # descending order, if same score, ascending order by id
+        ranked.sort(key=lambda x: (-round(x[1], 10), x[0]))     # descending order, if same score, ascending order by id (doc ids follow file number order)
 
         # output result
-        printed = set()             # file id already output
         for id, score, chosen in ranked:
-            assert id not in printed, f"dup doc {id}"       # remove duplicate
-            printed.add(id)
             if match_line:          # if >
-                print(f"> {id}")
+                print(f"> {self.docs[id]}")
                 self.print_match(id, chosen)       # print matched line
             else:
-                print(id)           # only output id
+                print(self.docs[id])        # only output id
 
         return ranked               # return sorted result list
 
     # output the matching line
-    def print_match(self, id: str, chosen: dict[str, int]):
-        file_path = os.path.join(self.index_folder, "doc", id)      # set up file path
-        if not os.path.isfile(file_path):           # file missing
-            return
-        with open(file_path, encoding="utf-8", errors="ignore") as f:
-            lines = f.readlines()                   # read all lines
+    def print_match(self, id: int, chosen: dict[str, int]):
+        file_path = os.path.join(self.index_folder, "doc", self.docs[id])      # set up file path
+        offsets_path = os.path.join(self.index_folder, "offsets", self.docs[id])      # line table of the file
+        if not os.path.isfile(file_path) or not os.path.isfile(offsets_path):
+            return                                  # file or its line table missing
+        line_offsets = array("q")                   # byte offset of each line
+        with open(offsets_path, "rb") as f:
+            line_offsets.fromfile(f, os.fstat(f.fileno()).st_size // line_offsets.itemsize)
 
         line_id = set()                             # record the line id to print
         for term, pos in chosen.items():
-            # Find all lines containing this term at the chosen position
-            for n, p, i in self.inverted_index.get(term, []):   # for all record of the term in inverted index
-                if n == id and p == pos:            # whether current position is chosen position
-                    line_id.add(i)                  # add line id
-                    # Don't break - there might be multiple lines with same term at same position
-
-        for i in sorted(line_id):               # ascending order by line id
-            if 0 <= i < len(lines):
-                line = lines[i]
-                if not line.endswith("\n"):     # wrap at each line end
-                    line += "\n"
-                print(line, end="")             # print content
+            # Find the line containing this term at the chosen position
+            seg = self.doc_segment(term, id)        # postings of the term in this file
+            i = bisect_left(self.positions, pos, seg.start, seg.stop)
+            if i < seg.stop and self.positions[i] == pos:       # whether it is the chosen position
+                line_id.add(self.line_ids[i])       # add line id
+
+        with open(file_path, "rb") as f:
+            for i in sorted(line_id):               # ascending order by line id
+                if 0 <= i < len(line_offsets):
+                    f.seek(line_offsets[i])         # jump to the line, read only that line
+                    line = f.readline().decode("utf-8", errors="ignore").rstrip("\r\n")
+                    print(line)                     # print content, wrap at each line end
 
 
 